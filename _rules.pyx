@@ -0,0 +1,506 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+#
+# C rule engine for hashcat_rule_gen, dispatching through a 128-entry table of
+# function pointers indexed by the opcode byte like hashcat's C apply_rule.
+# Build in place with:  cythonize -i _rules.pyx
+#
+# Each op edits buf[:n] in place and returns the new length. Cases whose result
+# depends on the quirks of the reference str lambdas (positions past the end,
+# empty words, non-ASCII results, buffer overflow) return -1, and the caller
+# redoes the rule in Python so results always match hashcat_rule.
+
+from libc.stdint cimport uint8_t, uint64_t
+from libc.string cimport memcpy, memmove
+
+cdef enum:
+    MAX_LEN = 256
+    MAX_OPS = 64
+
+ctypedef unsigned char uchar
+ctypedef int (*rule_op)(uchar* buf, int n, int y, int z) noexcept nogil
+
+cdef rule_op ops[128]
+cdef uint8_t n_args[128]  # Arity of each op, as in hashcat_rule_gen.num_args_dict
+
+
+cdef inline bint is_upper(uchar c) noexcept nogil:
+    return 65 <= c <= 90
+
+cdef inline bint is_lower(uchar c) noexcept nogil:
+    return 97 <= c <= 122
+
+# SWAR case masks: 0x80 in every byte of w that is A-Z / a-z. Only valid while
+# every byte is < 0x80, which holds since the engine only runs on ASCII.
+cdef inline uint64_t upper_mask(uint64_t w) noexcept nogil:
+    return ((w + 0x3f3f3f3f3f3f3f3fULL) ^ (w + 0x2525252525252525ULL)) & 0x8080808080808080ULL
+
+cdef inline uint64_t lower_mask(uint64_t w) noexcept nogil:
+    return ((w + 0x1f1f1f1f1f1f1f1fULL) ^ (w + 0x0505050505050505ULL)) & 0x8080808080808080ULL
+
+
+# Case rules
+
+cdef int op_noop(uchar* buf, int n, int y, int z) noexcept nogil:
+    return n
+
+cdef int op_l(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int i = 0
+    cdef uint64_t w
+    while i + 8 <= n:
+        memcpy(&w, buf + i, 8)
+        w |= upper_mask(w) >> 2
+        memcpy(buf + i, &w, 8)
+        i += 8
+    while i < n:
+        if is_upper(buf[i]):
+            buf[i] += 32
+        i += 1
+    return n
+
+cdef int op_u(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int i = 0
+    cdef uint64_t w
+    while i + 8 <= n:
+        memcpy(&w, buf + i, 8)
+        w &= ~(lower_mask(w) >> 2)
+        memcpy(buf + i, &w, 8)
+        i += 8
+    while i < n:
+        if is_lower(buf[i]):
+            buf[i] -= 32
+        i += 1
+    return n
+
+cdef int op_c(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int i
+    if n > 0 and is_lower(buf[0]):
+        buf[0] -= 32
+    for i in range(1, n):
+        if is_upper(buf[i]):
+            buf[i] += 32
+    return n
+
+cdef int op_C(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int i
+    if n == 0:
+        return -1
+    if is_upper(buf[0]):
+        buf[0] += 32
+    for i in range(1, n):
+        if is_lower(buf[i]):
+            buf[i] -= 32
+    return n
+
+cdef int op_t(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int i = 0
+    cdef uint64_t w
+    while i + 8 <= n:
+        memcpy(&w, buf + i, 8)
+        w ^= (upper_mask(w) | lower_mask(w)) >> 2
+        memcpy(buf + i, &w, 8)
+        i += 8
+    while i < n:
+        if is_upper(buf[i]) or is_lower(buf[i]):
+            buf[i] ^= 32
+        i += 1
+    return n
+
+cdef int op_E(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int i
+    if n == 0 or buf[0] == 32 or buf[n - 1] == 32:
+        return -1
+    for i in range(n):
+        if i == 0 or buf[i - 1] == 32:
+            if buf[i] == 32:
+                return -1  # Empty word, the reference raises
+            if is_lower(buf[i]):
+                buf[i] -= 32
+    return n
+
+cdef int op_T(uchar* buf, int n, int y, int z) noexcept nogil:
+    if y >= n:
+        return -1
+    if is_upper(buf[y]) or is_lower(buf[y]):
+        buf[y] ^= 32
+    return n
+
+
+# Rotation rules
+
+cdef int op_r(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int i = 0, j = n - 1
+    cdef uchar c
+    while i < j:
+        c = buf[i]
+        buf[i] = buf[j]
+        buf[j] = c
+        i += 1
+        j -= 1
+    return n
+
+cdef int op_rotl(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef uchar c
+    if n == 0:
+        return -1
+    c = buf[0]
+    memmove(buf, buf + 1, n - 1)
+    buf[n - 1] = c
+    return n
+
+cdef int op_rotr(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef uchar c
+    if n == 0:
+        return -1
+    c = buf[n - 1]
+    memmove(buf + 1, buf, n - 1)
+    buf[0] = c
+    return n
+
+
+# Duplication rules
+
+cdef int op_d(uchar* buf, int n, int y, int z) noexcept nogil:
+    if 2 * n > MAX_LEN:
+        return -1
+    memcpy(buf + n, buf, n)
+    return 2 * n
+
+cdef int op_f(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int i
+    if 2 * n > MAX_LEN:
+        return -1
+    for i in range(n):
+        buf[n + i] = buf[n - 1 - i]
+    return 2 * n
+
+cdef int op_q(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int i
+    if 2 * n > MAX_LEN:
+        return -1
+    for i in range(n - 1, -1, -1):
+        buf[2 * i + 1] = buf[i]
+        buf[2 * i] = buf[i]
+    return 2 * n
+
+cdef int op_p(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int j
+    if n * y > MAX_LEN:
+        return -1
+    for j in range(1, y):
+        memcpy(buf + j * n, buf, n)
+    return n * y
+
+cdef int op_z(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int i
+    if n == 0 or n + y > MAX_LEN:
+        return -1
+    memmove(buf + y, buf, n)
+    for i in range(1, y):
+        buf[i] = buf[0]
+    return n + y
+
+cdef int op_Z(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int i
+    if n == 0 or n + y > MAX_LEN:
+        return -1
+    for i in range(y):
+        buf[n + i] = buf[n - 1]
+    return n + y
+
+cdef int op_y(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int m = y if y < n else n
+    if n + m > MAX_LEN:
+        return -1
+    memmove(buf + m, buf, n)
+    memcpy(buf, buf + m, m)
+    return n + m
+
+cdef int op_Y(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int m = y if 0 < y < n else n  # x[-0:] and x[-big:] are the whole word
+    if n + m > MAX_LEN:
+        return -1
+    memcpy(buf + n, buf + n - m, m)
+    return n + m
+
+
+# Cutting rules
+
+cdef int op_lbracket(uchar* buf, int n, int y, int z) noexcept nogil:
+    if n == 0:
+        return 0
+    memmove(buf, buf + 1, n - 1)
+    return n - 1
+
+cdef int op_rbracket(uchar* buf, int n, int y, int z) noexcept nogil:
+    return n - 1 if n > 0 else 0
+
+cdef int op_D(uchar* buf, int n, int y, int z) noexcept nogil:
+    if y >= n:
+        return n
+    memmove(buf + y, buf + y + 1, n - y - 1)
+    return n - 1
+
+cdef int op_quote(uchar* buf, int n, int y, int z) noexcept nogil:
+    return y if y < n else n
+
+cdef int op_O(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int m
+    if y >= n:
+        return n
+    m = z if z < n - y else n - y
+    memmove(buf + y, buf + y + m, n - y - m)
+    return n - m
+
+cdef int op_x(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int m
+    if y >= n:
+        return 0
+    m = z if z < n - y else n - y
+    memmove(buf, buf + y, m)
+    return m
+
+cdef int op_at(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int i, j = 0
+    for i in range(n):
+        if buf[i] != y:
+            buf[j] = buf[i]
+            j += 1
+    return j
+
+
+# Insertion rules
+
+cdef int op_dollar(uchar* buf, int n, int y, int z) noexcept nogil:
+    if n + 1 > MAX_LEN:
+        return -1
+    buf[n] = y
+    return n + 1
+
+cdef int op_caret(uchar* buf, int n, int y, int z) noexcept nogil:
+    if n + 1 > MAX_LEN:
+        return -1
+    memmove(buf + 1, buf, n)
+    buf[0] = y
+    return n + 1
+
+cdef int op_i(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int m = y if y < n else n
+    if n + 1 > MAX_LEN:
+        return -1
+    memmove(buf + m + 1, buf + m, n - m)
+    buf[m] = z
+    return n + 1
+
+
+# Replacement rules
+
+cdef int op_o(uchar* buf, int n, int y, int z) noexcept nogil:
+    if y >= n:
+        return -1
+    buf[y] = z
+    return n
+
+cdef int op_s(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef int i
+    for i in range(n):
+        if buf[i] == y:
+            buf[i] = z
+    return n
+
+cdef int op_L(uchar* buf, int n, int y, int z) noexcept nogil:
+    if y >= n or buf[y] >= 0x40:
+        return -1
+    buf[y] <<= 1
+    return n
+
+cdef int op_R(uchar* buf, int n, int y, int z) noexcept nogil:
+    if y >= n:
+        return -1
+    buf[y] >>= 1
+    return n
+
+cdef int op_plus(uchar* buf, int n, int y, int z) noexcept nogil:
+    if y >= n or buf[y] >= 0x7F:
+        return -1
+    buf[y] += 1
+    return n
+
+cdef int op_minus(uchar* buf, int n, int y, int z) noexcept nogil:
+    if y >= n or buf[y] == 0:
+        return -1
+    buf[y] -= 1
+    return n
+
+cdef int op_dot(uchar* buf, int n, int y, int z) noexcept nogil:
+    if y + 1 >= n:
+        return -1
+    buf[y] = buf[y + 1]
+    return n
+
+cdef int op_comma(uchar* buf, int n, int y, int z) noexcept nogil:
+    if y == 0 or y >= n:
+        return -1
+    buf[y] = buf[y - 1]
+    return n
+
+
+# Swapping rules
+
+cdef int op_k(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef uchar c
+    if n < 2:
+        return -1
+    c = buf[0]
+    buf[0] = buf[1]
+    buf[1] = c
+    return n
+
+cdef int op_K(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef uchar c
+    if n < 2:
+        return -1
+    c = buf[n - 2]
+    buf[n - 2] = buf[n - 1]
+    buf[n - 1] = c
+    return n
+
+cdef int op_star(uchar* buf, int n, int y, int z) noexcept nogil:
+    cdef uchar c
+    if y == z or y >= n or z >= n:
+        return -1
+    c = buf[y]
+    buf[y] = buf[z]
+    buf[z] = c
+    return n
+
+
+cdef void init_ops():
+    cdef int i
+    for i in range(128):
+        ops[i] = NULL
+        n_args[i] = 0
+    for i in b"TpzZyYD'@$^LR+-.,":
+        n_args[i] = 1
+    for i in b"Oxios*":
+        n_args[i] = 2
+    ops[ord(':')] = op_noop
+    ops[ord('l')] = op_l
+    ops[ord('u')] = op_u
+    ops[ord('c')] = op_c
+    ops[ord('C')] = op_C
+    ops[ord('t')] = op_t
+    ops[ord('E')] = op_E
+    ops[ord('T')] = op_T
+    ops[ord('r')] = op_r
+    ops[ord('{')] = op_rotl
+    ops[ord('}')] = op_rotr
+    ops[ord('d')] = op_d
+    ops[ord('f')] = op_f
+    ops[ord('q')] = op_q
+    ops[ord('p')] = op_p
+    ops[ord('z')] = op_z
+    ops[ord('Z')] = op_Z
+    ops[ord('y')] = op_y
+    ops[ord('Y')] = op_Y
+    ops[ord('[')] = op_lbracket
+    ops[ord(']')] = op_rbracket
+    ops[ord('D')] = op_D
+    ops[ord("'")] = op_quote
+    ops[ord('O')] = op_O
+    ops[ord('x')] = op_x
+    ops[ord('@')] = op_at
+    ops[ord('$')] = op_dollar
+    ops[ord('^')] = op_caret
+    ops[ord('i')] = op_i
+    ops[ord('o')] = op_o
+    ops[ord('s')] = op_s
+    ops[ord('L')] = op_L
+    ops[ord('R')] = op_R
+    ops[ord('+')] = op_plus
+    ops[ord('-')] = op_minus
+    ops[ord('.')] = op_dot
+    ops[ord(',')] = op_comma
+    ops[ord('k')] = op_k
+    ops[ord('K')] = op_K
+    ops[ord('*')] = op_star
+
+init_ops()
+
+
+cdef int run_ops(uchar* buf, int n, const uint8_t* opcodes, const uint8_t* p0,
+                 const uint8_t* p1, Py_ssize_t n_ops) noexcept nogil:
+    cdef Py_ssize_t k
+    cdef rule_op op
+    for k in range(n_ops):
+        if opcodes[k] >= 128:
+            return -1
+        op = ops[opcodes[k]]
+        if op == NULL:
+            return -1
+        n = op(buf, n, p0[k], p1[k])
+        if n < 0:
+            return -1
+    return n
+
+
+cdef inline int encode_arg(object arg):
+    if isinstance(arg, int):
+        return arg if 0 <= arg < 256 else -1
+    if isinstance(arg, str) and len(<str>arg) == 1 and ord(arg) < 128:
+        return ord(arg)
+    return -1
+
+
+def apply_parsed_rule(str password, rule):
+    """Apply a parsed hashcat_rule_gen rule, None if Python has to handle it"""
+    cdef uchar buf[MAX_LEN]
+    cdef uint8_t opcodes[MAX_OPS]
+    cdef uint8_t p0[MAX_OPS]
+    cdef uint8_t p1[MAX_OPS]
+    cdef Py_ssize_t n_ops = 0
+    cdef int n, y, z
+    if len(password) > MAX_LEN or not password.isascii():
+        return None
+    for rule_type, args in rule:
+        # Fused rules from fuse_rule run as the single ops they replaced
+        if rule_type in ('$$', '^^', '[[', ']]', 'dd') and len(args) != 1:
+            return None
+        if rule_type == '$$' or rule_type == '^^':
+            chars = args[0] if rule_type == '$$' else args[0][::-1]
+            if n_ops + len(chars) > MAX_OPS:
+                return None
+            for ch in chars:
+                y = encode_arg(ch)
+                if y < 0:
+                    return None
+                opcodes[n_ops], p0[n_ops], p1[n_ops] = ord(rule_type[0]), y, 0
+                n_ops += 1
+            continue
+        if rule_type == '[[' or rule_type == ']]' or rule_type == 'dd':
+            y = encode_arg(args[0])
+            if y < 0 or n_ops + y > MAX_OPS:
+                return None
+            for _ in range(y):
+                opcodes[n_ops], p0[n_ops], p1[n_ops] = ord(rule_type[0]), 0, 0
+                n_ops += 1
+            continue
+
+        if len(rule_type) != 1 or ord(rule_type) >= 128 or n_ops == MAX_OPS:
+            return None
+        if len(args) != n_args[ord(rule_type)]:
+            return None  # Truncated rule, the lambda raises
+        y = encode_arg(args[0]) if len(args) > 0 else 0
+        z = encode_arg(args[1]) if len(args) > 1 else 0
+        if y < 0 or z < 0:
+            return None
+        opcodes[n_ops], p0[n_ops], p1[n_ops] = ord(rule_type), y, z
+        n_ops += 1
+
+    pw = password.encode('ascii')
+    n = len(pw)
+    memcpy(buf, <const char*>pw, n)
+    with nogil:
+        n = run_ops(buf, n, opcodes, p0, p1, n_ops)
+    if n < 0:
+        return None
+    return buf[:n].decode('ascii')
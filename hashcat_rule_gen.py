@@ -1,6 +1,14 @@
-from typing import Any, List, Tuple, Set
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple, Set
 from functools import lru_cache
 
+try:
+    import _rules # Optional Cython rule engine, built from _rules.pyx
+except ImportError:
+    _rules = None
+
 # Implementations of each rule are pulled from https://gist.github.com/rarecoil/8b964b473eb8d47c70dea0a86b772f60#file-rulegen-py3
 
 _i = {
@@ -29,7 +37,8 @@ hashcat_rule["u"] = lambda x: x.upper()                            # Capitalize
 hashcat_rule["c"] = lambda x: x.capitalize()                       # Capitalize the first letter
 hashcat_rule["C"] = lambda x: x[0].lower() + x[1:].upper()         # Lowercase the first found character, uppercase the rest
 hashcat_rule["t"] = lambda x: x.swapcase()                         # Toggle the case of all characters in word
-hashcat_rule["E"] = lambda x: " ".join([i[0].upper()+i[1:] for i in x.split(" ")]) # Upper case the first letter and every letter after a space
+hashcat_rule["E"] = lambda x: (x[0].upper()+x[1:] if " " not in x  # Upper case the first letter and every letter after a space
+                               else " ".join([i[0].upper()+i[1:] for i in x.split(" ")]))
 hashcat_rule["T"] = lambda x,y: x[:y] + x[y].swapcase() + x[y+1:]  # Toggle the case of characters at position N
 
         # Rotation rules
@@ -37,6 +46,8 @@ hashcat_rule["r"] = lambda x: x[::-1]                              # Reverse the
 hashcat_rule["{"] = lambda x: x[1:]+x[0]                           # Rotate the word left
 hashcat_rule["}"] = lambda x: x[-1]+x[:-1]                         # Rotate the word right
 
+# Note: d, f and p are single C-level str operations and q's join beats a NumPy
+# np.repeat/np.tile round trip through bytes (about 2x slower at password lengths).
         # Duplication rules
 hashcat_rule["d"] = lambda x: x+x                                  # Duplicate entire word
 hashcat_rule["f"] = lambda x: x+x[::-1]                            # Duplicate word reversed
@@ -61,6 +72,8 @@ hashcat_rule["$"] = lambda x,y: x+y                                # Append char
 hashcat_rule["^"] = lambda x,y: y+x                                # Prepend character to front
 hashcat_rule["i"] = lambda x,y,z: x[:y]+z+x[y:]                    # Insert character X at position N
 
+# Note: str.replace is kept over str.translate with a maketrans table, even for runs of
+# s rules; on password-length strings translate's per-character mapping lookups are ~10x slower
         # Replacement rules
 hashcat_rule["o"] = lambda x,y,z: x[:y]+z+x[y+1:]                  # Overwrite character at position N with X
 hashcat_rule["s"] = lambda x,y,z: x.replace(y,z)                   # Replace all instances of X with Y
@@ -79,6 +92,13 @@ def star_func(x,y,z):
     return x[:y]+x[z]+x[y+1:z]+x[y]+x[z+1:] if z > y else x[:z]+x[y]+x[z+1:y]+x[z]+x[y+1:] # Swap character X with Y
 hashcat_rule["*"] = star_func
 
+        # Fused rules, only produced by fuse_rule
+hashcat_rule["$$"] = lambda x,y: x+y                               # Append string to end
+hashcat_rule["^^"] = lambda x,y: y+x                               # Prepend string to front
+hashcat_rule["[["] = lambda x,y: x[y:]                             # Delete first N characters
+hashcat_rule["]]"] = lambda x,y: x[:-y]                            # Delete last N characters
+hashcat_rule["dd"] = lambda x,y: x*(1<<y)                          # Duplicate entire word, N times over
+
 num_args_dict = {k: get_num_args(v)-1 for k,v in hashcat_rule.items()}
 
 
@@ -88,6 +108,12 @@ RuleType = str
 RuleArgs = List[str]
 Rule = List[Tuple[RuleType, RuleArgs]]
 
+# Parse metadata indexed by ord(rule_type): number of arguments (0xFF if unknown),
+# and whether the first / second argument is a position to decode with _i
+_NARGS = bytes(num_args_dict.get(chr(c), 0xFF) for c in range(128))
+_POS_N = bytes(chr(c) in "TpZzYyD'xOoLR+-.,*i" for c in range(128))
+_POS_M = bytes(chr(c) in "xO*" for c in range(128))
+
 def parse_rule(unparsed_rule: str) -> Rule:
     """Take a string representation of a rule and return a list of tuples 
     separating the rule type and arguments
@@ -97,31 +123,158 @@ def parse_rule(unparsed_rule: str) -> Rule:
         result = []
         while rule != "":
             rule_type = rule[0]
-            num_args = num_args_dict[rule_type]
+            c = ord(rule_type)
+            num_args = _NARGS[c] if c < 128 else 0xFF
+            if num_args == 0xFF:
+                raise KeyError(rule_type)
             args : List[Any] = [*rule[1:1+num_args]] 
-            if rule_type in ["T", "p", "Z", 'z', 'Y', 'y', 'D', "'", 'x', 'O',
-                            'o', "L", "R", "+", "-", ".", ",", "*", "i"]:
+            if _POS_N[c]:
                 args[0] = _i[args[0]]
-            if rule_type in ['x', 'O', '*']:
+            if _POS_M[c]:
                 args[1] = _i[args[1]]
 
             rule = rule[1+num_args+1:] # additional +1 to skip space
             result.append((rule_type, args))
-        return result
+        return fuse_rule(result)
     except Exception as e:
         print(f"Error parsing rule '{unparsed_rule}': {e}")
         raise e
         return None
     
+# Runs of these rules are merged into one fused rule by fuse_rule
+_fused_rule = {'$': '$$', '^': '^^', '[': '[[', ']': ']]', 'd': 'dd'}
+
+def fuse_rule(rule: Rule) -> Rule:
+    """Merge runs of appends, prepends, deletes and duplications into single 
+    steps, e.g. $1 $2 $3 -> ('$$', ['123']) and d d -> ('dd', [2])
+    """
+    result = []
+    i = 0
+    while i < len(rule):
+        rule_type, args = rule[i]
+        j = i + 1
+        while j < len(rule) and rule[j][0] == rule_type:
+            j += 1
+        run = rule[i:j]
+        i = j
+
+        if len(run) == 1 or not all(len(a) == num_args_dict[rule_type] for _, a in run):
+            result.extend(run)
+        elif rule_type == '$':
+            result.append(('$$', [''.join(a[0] for _, a in run)]))
+        elif rule_type == '^':
+            result.append(('^^', [''.join(a[0] for _, a in reversed(run))]))
+        elif rule_type in _fused_rule:
+            result.append((_fused_rule[rule_type], [len(run)]))
+        else:
+            result.extend(run)
+    return result
+
+def expand_rule(rule: Rule) -> Rule:
+    """Split fused rules back into single hashcat rules"""
+    result = []
+    for rule_type, args in rule:
+        if rule_type == '$$':
+            result.extend(('$', [c]) for c in args[0])
+        elif rule_type == '^^':
+            result.extend(('^', [c]) for c in reversed(args[0]))
+        elif rule_type in ('[[', ']]', 'dd'):
+            result.extend((rule_type[0], []) for _ in range(args[0]))
+        else:
+            result.append((rule_type, args))
+    return result
+
 def apply_rule(password: str, rule: Rule) -> str:
     """Apply a rule to a password and return the transformed password"""
+    if _rules is not None:
+        result = _rules.apply_parsed_rule(password, rule)
+        if result is not None:
+            return result
+
     result = password
 
     for rule_type, args in rule:
+        if (rule_type == 's' and len(args) == 2 or rule_type == '@' and len(args) == 1) and args[0] not in result:
+            continue  # Nothing to replace, the step leaves the word unchanged
         result = hashcat_rule[rule_type](result, *args)
         
     return result
 
+# Source templates for compile_rule, one expression of x per rule type that
+# matches the hashcat_rule lambda. Rules not listed are emitted as a call to it.
+_rule_src = {
+    ':': lambda: 'x',
+    'l': lambda: 'x.lower()',
+    'u': lambda: 'x.upper()',
+    'c': lambda: 'x.capitalize()',
+    'C': lambda: 'x[0].lower()+x[1:].upper()',
+    't': lambda: 'x.swapcase()',
+    'E': lambda: 'x[0].upper()+x[1:] if " " not in x else hashcat_rule["E"](x)',
+    'T': lambda y: f'x[:{y}]+x[{y}].swapcase()+x[{y+1}:]',
+    'r': lambda: 'x[::-1]',
+    '{': lambda: 'x[1:]+x[0]',
+    '}': lambda: 'x[-1]+x[:-1]',
+    'd': lambda: 'x+x',
+    'f': lambda: 'x+x[::-1]',
+    'q': lambda: '"".join([i+i for i in x])',
+    'p': lambda y: f'x*{y}',
+    'z': lambda y: f'x[0]*{y}+x',
+    'Z': lambda y: f'x+x[-1]*{y}',
+    'y': lambda y: f'x[:{y}]+x',
+    'Y': lambda y: f'x+x[-{y}:]',
+    '[': lambda: 'x[1:]',
+    ']': lambda: 'x[:-1]',
+    'D': lambda y: f'x[:{y}]+x[{y+1}:]',
+    "'": lambda y: f'x[:{y}]',
+    'O': lambda y,z: f'x[:{y}]+x[{y+z}:]',
+    'x': lambda y,z: f'x[{y}:{y+z}]',
+    '@': lambda y: f'x.replace({y!r},"")',
+    '$': lambda y: f'x+{y!r}',
+    '^': lambda y: f'{y!r}+x',
+    'i': lambda y,z: f'x[:{y}]+{z!r}+x[{y}:]',
+    'o': lambda y,z: f'x[:{y}]+{z!r}+x[{y+1}:]',
+    's': lambda y,z: f'x.replace({y!r},{z!r})',
+    'L': lambda y: f'x[:{y}]+chr(ord(x[{y}])<<1)+x[{y+1}:]',
+    'R': lambda y: f'x[:{y}]+chr(ord(x[{y}])>>1)+x[{y+1}:]',
+    '+': lambda y: f'x[:{y}]+chr(ord(x[{y}])+1)+x[{y+1}:]',
+    '-': lambda y: f'x[:{y}]+chr(ord(x[{y}])-1)+x[{y+1}:]',
+    '.': lambda y: f'x[:{y}]+x[{y+1}]+x[{y+1}:]',
+    ',': lambda y: f'x[:{y}]+x[{y-1}]+x[{y+1}:]',
+    'k': lambda: 'x[1]+x[0]+x[2:]',
+    'K': lambda: 'x[:-2]+x[-1]+x[-2]',
+    '$$': lambda y: f'x+{y!r}',
+    '^^': lambda y: f'{y!r}+x',
+    '[[': lambda y: f'x[{y}:]',
+    ']]': lambda y: f'x[:-{y}]',
+    'dd': lambda y: f'x*{1<<y}',
+}
+
+CompiledRule = Callable[[str], str]
+
+def compile_rule(rule: Rule) -> CompiledRule:
+    """Generate a single Python function applying every step of the rule, 
+    with the arguments baked in as constants
+    """
+    return _compile_rule(tuple((rule_type, tuple(args)) for rule_type, args in rule))
+
+@lru_cache(maxsize=None)
+def _compile_rule(rule: Tuple[Tuple[RuleType, Tuple[Any, ...]], ...]) -> CompiledRule:
+    namespace = {'hashcat_rule': hashcat_rule}
+    lines = ["def _r(x):"]
+    for rule_type, args in rule:
+        try:
+            lines.append(f"    x={_rule_src[rule_type](*args)}")
+        except (KeyError, TypeError):
+            # No template (or malformed args), call the lambda so it fails the same way
+            lines.append(f"    x=hashcat_rule[{rule_type!r}](x,*{args!r})")
+    lines.append("    return x")
+    exec(compile("\n".join(lines), "<rule>", "exec"), namespace)
+    return namespace["_r"]
+
+def compile_rules(rules: List[Rule]) -> List[CompiledRule]:
+    """Compile a list of rules, see compile_rule"""
+    return [compile_rule(r) for r in rules]
+
 def load_rockyou() -> List[Rule]:
     return load_rules('rockyou-30000.rule')
 
@@ -134,23 +287,67 @@ def load_best64() -> List[Rule]:
     
 def load_rules(path: str) -> List[Rule]:
     """Load rules from a file and return a list of parsed rules"""
-    with open(path) as f:
-        results = []
-        for x in f.readlines():
-            if x.startswith('#'):
-                continue
-            if x == '\n':
-                continue
-            results.append(parse_rule(x.strip('\n')))
-    return results    
+    with open(path, buffering=1<<20) as f:
+        # Stream the file, skipping comments and blank lines before parsing
+        return [parse_rule(x[:-1] if x.endswith('\n') else x)
+                for x in f if x[0] not in '#\n']
 
 def apply_rules(password: str, rules: List[Rule]) -> Set[str]:
-    """Apply a list of rules to a password and return the results"""
+    """Apply a list of rules to a password and return the results.
+    Rules may also be compiled with compile_rules, or encoded with 
+    rules_jit.encode_rules to run on the numba engine.
+    """
+    # rules_jit (numba) is only loaded if the caller encoded rules with it
+    rules_jit = sys.modules.get('rules_jit')
+    if rules_jit is not None and isinstance(rules, rules_jit.EncodedRules):
+        return rules_jit.apply_rules(password, rules)
     output = set()
+    add = output.add
     for r in rules:
         try:
-            output.add(apply_rule(password, r))
+            add(r(password) if callable(r) else apply_rule(password, r))
         except Exception as e:
             # print(f"Error applying rule {r}: {e}")
             pass
-    return output
\ No newline at end of file
+    return output
+
+# Rules of the current apply_rules_many pool, set in each worker by _init_worker
+_worker_rules = None
+
+def _init_worker(rules):
+    global _worker_rules
+    _worker_rules = rules
+
+def _apply_worker_rules(password: str) -> Set[str]:
+    return apply_rules(password, _worker_rules)
+
+def _pool_context():
+    # fork shares rules (including compiled ones) without pickling, but is only
+    # safe on Linux, and only before numba has started its thread pool
+    if not sys.platform.startswith('linux'):
+        return multiprocessing.get_context('spawn')
+    numba = sys.modules.get('numba')
+    if numba is not None:
+        try:
+            numba.threading_layer()
+            return multiprocessing.get_context('forkserver')
+        except ValueError:
+            pass  # Thread pool not started yet
+    return multiprocessing.get_context('fork')
+
+def apply_rules_many(passwords: Iterable[str], rules: List[Rule], workers: Optional[int] = None,
+                     chunksize: int = 256) -> Iterator[Set[str]]:
+    """Apply a list of rules to every password across worker processes, 
+    yielding the results in password order. Rules may be encoded as for 
+    apply_rules, and compiled only where the workers are forked (Linux), 
+    since compiled rules cannot be pickled.
+    """
+    context = _pool_context()
+    rules_jit = sys.modules.get('rules_jit')
+    is_encoded = rules_jit is not None and isinstance(rules, rules_jit.EncodedRules)
+    if context.get_start_method() != 'fork' and not is_encoded and any(callable(r) for r in rules):
+        raise TypeError(f"compiled rules cannot be sent to {context.get_start_method()} workers, "
+                        "pass the parsed rules instead")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(rules,)) as pool:
+        yield from pool.map(_apply_worker_rules, passwords, chunksize=chunksize)
@@ -1,19 +1,63 @@
 import ast
+import codecs
+import re
+from itertools import islice
 from pathlib import Path
 from typing import Iterable, List, Tuple, Any
 
+from hashcat_rule_gen import expand_rule
+
+# Hashcat writes positions 0-35 as a single character
+_POSITIONS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+def format_arg(arg: Any) -> str:
+    return _POSITIONS[arg] if isinstance(arg, int) else str(arg)
+
 def format_action(action: Tuple[str, List[Any]]) -> str:
     """
     action = (type, payload_list) -> '{type}{payload_items_joined_without_separators}'
     """
     t, payload = action
-    return f"{t}{''.join(map(str, payload))}"
+    return f"{t}{''.join(map(format_arg, payload))}"
 
 def format_rule(actions: List[Tuple[str, List[Any]]]) -> str:
     """
     rule = list of actions -> 'action action ...' (single-space separated)
+    Fused actions ('$$', '[[', ...) are written out as the single actions they replaced.
     """
-    return ' '.join(format_action(a) for a in actions)
+    return ' '.join(format_action(a) for a in expand_rule(actions))
+
+# Python string literal as written by repr(), or a non-negative int, with only
+# the whitespace Python allows between tokens inside brackets
+_STR = r"'(?:[^'\\\r\n]|\\.)*'" + r'|"(?:[^"\\\r\n]|\\.)*"'
+_ITEM = rf"(?:{_STR}|0|[1-9][0-9]*)"
+_WS = r"[ \t\f\r\n]*"
+_ACTION_RE = re.compile(
+    rf"{_WS}\({_WS}({_STR}){_WS},{_WS}\[{_WS}((?:{_ITEM}(?:{_WS},{_WS}{_ITEM})*{_WS},?)?){_WS}\]{_WS}\){_WS}(?:,|$)")
+_ITEM_RE = re.compile(_ITEM)
+
+def _literal(token: str) -> Any:
+    if token[0] in "'\"":
+        return ast.literal_eval(token) if '\\' in token else token[1:-1]
+    return int(token)
+
+def parse_line(line: str) -> List[Tuple[str, List[Any]]]:
+    """
+    Parse one "[('type', [payload, ...]), ...]" line with a regex instead of the
+    full Python parser. Same result as ast.literal_eval, which is still used for
+    lines of any other shape.
+    """
+    if not (line.startswith('[') and line.endswith(']')):
+        return ast.literal_eval(line)
+    actions = []
+    pos, end = 1, len(line) - 1
+    while pos < end:
+        m = _ACTION_RE.match(line, pos, end)
+        if m is None:
+            return ast.literal_eval(line)
+        actions.append((_literal(m.group(1)), [_literal(t) for t in _ITEM_RE.findall(m.group(2))]))
+        pos = m.end()
+    return actions
 
 def parse_rules(lines: Iterable[str]) -> List[str]:
     """
@@ -25,10 +69,13 @@ def parse_rules(lines: Iterable[str]) -> List[str]:
         line = line.strip()
         if not line:
             continue
-        actions = ast.literal_eval(line)
+        actions = parse_line(line)
         out.append(format_rule(actions))
     return out
 
+# Number of rules joined into each write by export_rules
+EXPORT_CHUNK_SIZE = 8192
+
 def export_rules(
     rules: Iterable[str],
     output_path: str | Path,
@@ -61,11 +108,18 @@ def export_rules(
     path = Path(output_path)
     path.parent.mkdir(parents=True, exist_ok=True)
     count = 0
-    with path.open(mode=mode, encoding=encoding, newline="") as f:
-        for r in rules:
-            f.write(r)
-            f.write(newline)
-            count += 1
+    rules = iter(rules)
+    # Binary mode: each chunk is encoded in one call instead of one text layer
+    # write per rule. The incremental encoder writes a BOM (utf-16, utf-8-sig)
+    # only at the start of the file, as the text layer does.
+    encode = codecs.getincrementalencoder(encoding)()
+    with path.open(mode=mode.replace("b", "").replace("t", "") + "b", buffering=1 << 20) as f:
+        if f.tell() != 0:
+            encode.setstate(0)
+        # One write per chunk of rules keeps memory bounded for large iterables
+        while chunk := list(islice(rules, EXPORT_CHUNK_SIZE)):
+            f.write(encode.encode(newline.join(chunk) + newline))
+            count += len(chunk)
     return count
 
 def parse_and_export(
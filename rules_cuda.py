@@ -0,0 +1,110 @@
+import math
+from typing import List, Optional, Set
+
+import numpy as np
+from numba import cuda, uint8
+
+import hashcat_rule_gen
+import rules_jit
+
+# GPU rule engine in the style of hashcat's on-device rules: one thread per
+# (password, rule) pair, each running the opcode interpreter on a local
+# CUDA_WIDTH byte buffer. The interpreter is rules_jit.apply_rule_nb compiled
+# again as a device function, so CPU and GPU share one implementation and
+# defer (length -1) in the same cases, which are then redone in Python.
+
+CUDA_WIDTH = rules_jit.BATCH_WIDTH
+BATCH_SIZE = 1 << 14     # Most passwords per batch
+MEMORY_BUDGET = 1 << 30  # Device bytes for the outputs of the two batches in flight
+
+_apply_rule_dev = cuda.jit(device=True)(rules_jit.apply_rule_nb.py_func)
+
+
+@cuda.jit
+def _apply_all(pw, pw_len, opcodes, p0s, p1s, offsets, out, out_len):
+    i, r = cuda.grid(2)
+    if i >= pw.shape[0] or r >= offsets.shape[0] - 1:
+        return
+    buf = cuda.local.array(CUDA_WIDTH, uint8)
+    n = pw_len[i]
+    for k in range(n):
+        buf[k] = pw[i, k]
+    start = offsets[r]
+    end = offsets[r + 1]
+    n = _apply_rule_dev(buf, n, opcodes[start:end], p0s[start:end], p1s[start:end], end - start)
+    out_len[r, i] = n
+    for k in range(n):
+        out[r, i, k] = buf[k]
+
+
+def rules_to_device(encoded: rules_jit.EncodedRules, stream=0):
+    """Copy encoded rules to the GPU as (opcodes, p0s, p1s, offsets)"""
+    return tuple(cuda.to_device(a, stream=stream)
+                 for a in (encoded.opcodes, encoded.p0s, encoded.p1s, encoded.offsets))
+
+
+def cuda_apply_rules(pw_dev, lens_dev, rules_dev, stream=0):
+    """Apply every rule to every password on the GPU.
+
+    pw_dev is a uint8[N, CUDA_WIDTH] device array with lengths lens_dev, and
+    rules_dev comes from rules_to_device. Returns device arrays
+    (out uint8[R, N, CUDA_WIDTH], out_lens int16[R, N]).
+    """
+    n_rows = pw_dev.shape[0]
+    n_rules = rules_dev[3].shape[0] - 1
+    out = cuda.device_array((n_rules, n_rows, CUDA_WIDTH), dtype=np.uint8, stream=stream)
+    out_lens = cuda.device_array((n_rules, n_rows), dtype=np.int16, stream=stream)
+    if n_rows and n_rules:
+        threads = (32, 8)
+        blocks = (math.ceil(n_rows / threads[0]), math.ceil(n_rules / threads[1]))
+        _apply_all[blocks, threads, stream](pw_dev, lens_dev, *rules_dev, out, out_lens)
+    return out, out_lens
+
+
+def batch_size_for(n_rules: int) -> int:
+    """Passwords per batch so both batches' outputs fit in MEMORY_BUDGET"""
+    per_password = 2 * max(n_rules, 1) * (CUDA_WIDTH + np.dtype(np.int16).itemsize)
+    return max(1, min(BATCH_SIZE, MEMORY_BUDGET // per_password))
+
+
+def apply_rules_cuda(passwords: List[str], rules: List[hashcat_rule_gen.Rule],
+                     batch_size: Optional[int] = None) -> Set[str]:
+    """Apply every rule to every password on the GPU, return the union of all
+    results. Same as rules_jit.apply_rules_batch. batch_size defaults to 
+    batch_size_for(len(rules)).
+    """
+    if batch_size is None:
+        batch_size = batch_size_for(len(rules))
+    fits, base, base_lens, rest = rules_jit.encode_batch(list(passwords), CUDA_WIDTH)
+    output = set()
+    for password in rest:
+        output |= hashcat_rule_gen.apply_rules(password, rules)
+
+    def collect(start, out, out_lens, stream):
+        out, out_lens = out.copy_to_host(stream=stream), out_lens.copy_to_host(stream=stream)
+        stream.synchronize()
+        for r, rule in enumerate(rules):
+            output.update(rules_jit.decode_unique(out[r], out_lens[r]))
+            for i in np.flatnonzero(out_lens[r] < 0):
+                try:
+                    output.add(hashcat_rule_gen.apply_rule(fits[start + i], rule))
+                except Exception:
+                    pass
+
+    rules_dev = rules_to_device(rules_jit.encode_rules(rules))
+    streams = (cuda.stream(), cuda.stream())
+    pending = None
+    with cuda.pinned(base), cuda.pinned(base_lens):
+        # Alternate streams so the next batch's copy and kernel overlap with
+        # decoding the previous one on the host
+        for b, start in enumerate(range(0, len(fits), batch_size)):
+            stream = streams[b % 2]
+            pw_dev = cuda.to_device(base[start:start + batch_size], stream=stream)
+            lens_dev = cuda.to_device(base_lens[start:start + batch_size], stream=stream)
+            out, out_lens = cuda_apply_rules(pw_dev, lens_dev, rules_dev, stream)
+            if pending is not None:
+                collect(*pending)
+            pending = (start, out, out_lens, stream)
+        if pending is not None:
+            collect(*pending)
+    return output
@@ -0,0 +1,510 @@
+from __future__ import annotations
+
+import threading
+from typing import List, NamedTuple, Set
+
+import numpy as np
+from numba import njit, prange
+
+import hashcat_rule_gen
+
+# Numba port of the rule interpreter in hashcat_rule_gen, shaped like hashcat's
+# C apply_rule(name, p0, p1, buf, len): each rule is compiled once into parallel
+# uint8 arrays (opcode, p0, p1) and run in-place on a fixed size byte buffer.
+#
+# The kernel only handles the well-defined, in-range ASCII cases. Anything else
+# (empty words, positions past the end, non-ASCII results, buffer overflow)
+# returns -1 and is re-run through hashcat_rule_gen.apply_rule, so results are
+# always identical to the reference lambdas.
+
+MAX_LEN = 256
+
+
+class EncodedRules(NamedTuple):
+    rules: List[hashcat_rule_gen.Rule]  # Original rules, used for fallback
+    opcodes: np.ndarray                 # uint8[total_ops]
+    p0s: np.ndarray                     # uint8[total_ops]
+    p1s: np.ndarray                     # uint8[total_ops]
+    offsets: np.ndarray                 # int64[n_rules+1], rule i is ops[offsets[i]:offsets[i+1]]
+
+
+def _encode_arg(arg) -> int:
+    if isinstance(arg, int):
+        return arg
+    c = ord(arg)
+    if c > 0x7F:
+        raise ValueError("non-ASCII argument")
+    return c
+
+
+def _encode_ops(rule: hashcat_rule_gen.Rule, opcodes: list, p0s: list, p1s: list) -> int:
+    """Append a parsed rule's steps to the opcode and argument lists, return the step count"""
+    rule = hashcat_rule_gen.expand_rule(rule)
+    for rule_type, args in rule:
+        try:
+            if len(args) != hashcat_rule_gen.num_args_dict.get(rule_type):
+                # Truncated rules make the lambda raise, leave that to Python
+                raise ValueError("wrong number of arguments")
+            p0 = _encode_arg(args[0]) if len(args) > 0 else 0
+            p1 = _encode_arg(args[1]) if len(args) > 1 else 0
+            op = ord(rule_type)
+        except (ValueError, TypeError):
+            op = p0 = p1 = 0  # Opcode 0 is unknown to the kernel and defers to Python
+        opcodes.append(op)
+        p0s.append(p0)
+        p1s.append(p1)
+    return len(rule)
+
+
+def encode_rule(rule: hashcat_rule_gen.Rule):
+    """Compile a parsed rule into (opcodes, p0s, p1s) uint8 arrays"""
+    ops = [], [], []
+    _encode_ops(rule, *ops)
+    return tuple(np.array(a, dtype=np.uint8) for a in ops)
+
+
+def encode_rules(rules: List[hashcat_rule_gen.Rule]) -> EncodedRules:
+    """Compile a list of parsed rules into flat arrays for the kernel"""
+    ops = [], [], []
+    offsets = np.zeros(len(rules) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([_encode_ops(r, *ops) for r in rules])
+    opcodes, p0s, p1s = (np.array(a, dtype=np.uint8) for a in ops)
+    return EncodedRules(list(rules), opcodes, p0s, p1s, offsets)
+
+
+@njit(cache=True)
+def apply_rule_nb(buf, length, opcodes, p0s, p1s, n_ops) -> int:
+    """Apply one encoded rule to buf[:length] in-place, return the new length or -1"""
+    cap = buf.shape[0]
+    n = length
+    for k in range(n_ops):
+        op = opcodes[k]
+        y = np.int64(p0s[k])
+        z = np.int64(p1s[k])
+
+        if op == 58:  # ':'
+            pass
+
+        # Case rules
+        elif op == 108:  # 'l'
+            for i in range(n):
+                if 65 <= buf[i] <= 90:
+                    buf[i] += 32
+        elif op == 117:  # 'u'
+            for i in range(n):
+                if 97 <= buf[i] <= 122:
+                    buf[i] -= 32
+        elif op == 99:  # 'c'
+            if n > 0 and 97 <= buf[0] <= 122:
+                buf[0] -= 32
+            for i in range(1, n):
+                if 65 <= buf[i] <= 90:
+                    buf[i] += 32
+        elif op == 67:  # 'C'
+            if n == 0:
+                return -1
+            if 65 <= buf[0] <= 90:
+                buf[0] += 32
+            for i in range(1, n):
+                if 97 <= buf[i] <= 122:
+                    buf[i] -= 32
+        elif op == 116:  # 't'
+            for i in range(n):
+                if 65 <= buf[i] <= 90 or 97 <= buf[i] <= 122:
+                    buf[i] ^= 32
+        elif op == 69:  # 'E'
+            # Reference raises on empty words between spaces
+            if n == 0 or buf[0] == 32 or buf[n - 1] == 32:
+                return -1
+            for i in range(n):
+                if i == 0 or buf[i - 1] == 32:
+                    if buf[i] == 32:
+                        return -1
+                    if 97 <= buf[i] <= 122:
+                        buf[i] -= 32
+        elif op == 84:  # 'T'
+            if y >= n:
+                return -1
+            if 65 <= buf[y] <= 90 or 97 <= buf[y] <= 122:
+                buf[y] ^= 32
+
+        # Rotation rules
+        elif op == 114:  # 'r'
+            i = 0
+            j = n - 1
+            while i < j:
+                c = buf[i]
+                buf[i] = buf[j]
+                buf[j] = c
+                i += 1
+                j -= 1
+        elif op == 123:  # '{'
+            if n == 0:
+                return -1
+            c = buf[0]
+            for i in range(n - 1):
+                buf[i] = buf[i + 1]
+            buf[n - 1] = c
+        elif op == 125:  # '}'
+            if n == 0:
+                return -1
+            c = buf[n - 1]
+            for i in range(n - 1, 0, -1):
+                buf[i] = buf[i - 1]
+            buf[0] = c
+
+        # Duplication rules
+        elif op == 100:  # 'd'
+            if 2 * n > cap:
+                return -1
+            for i in range(n):
+                buf[n + i] = buf[i]
+            n *= 2
+        elif op == 102:  # 'f'
+            if 2 * n > cap:
+                return -1
+            for i in range(n):
+                buf[n + i] = buf[n - 1 - i]
+            n *= 2
+        elif op == 113:  # 'q'
+            if 2 * n > cap:
+                return -1
+            for i in range(n - 1, -1, -1):
+                buf[2 * i + 1] = buf[i]
+                buf[2 * i] = buf[i]
+            n *= 2
+        elif op == 112:  # 'p'
+            if n * y > cap:
+                return -1
+            for j in range(1, y):
+                for i in range(n):
+                    buf[j * n + i] = buf[i]
+            n *= y
+        elif op == 122:  # 'z'
+            if n == 0 or n + y > cap:
+                return -1
+            for i in range(n - 1, -1, -1):
+                buf[i + y] = buf[i]
+            for i in range(1, y):
+                buf[i] = buf[0]
+            n += y
+        elif op == 90:  # 'Z'
+            if n == 0 or n + y > cap:
+                return -1
+            for i in range(y):
+                buf[n + i] = buf[n - 1]
+            n += y
+        elif op == 121:  # 'y'
+            m = min(y, n)
+            if n + m > cap:
+                return -1
+            for i in range(n - 1, -1, -1):
+                buf[i + m] = buf[i]
+            for i in range(m):
+                buf[i] = buf[i + m]
+            n += m
+        elif op == 89:  # 'Y'
+            m = y if 0 < y < n else n  # x[-0:] and x[-big:] are the whole word
+            if n + m > cap:
+                return -1
+            for i in range(m):
+                buf[n + i] = buf[n - m + i]
+            n += m
+
+        # Cutting rules
+        elif op == 91:  # '['
+            if n > 0:
+                for i in range(n - 1):
+                    buf[i] = buf[i + 1]
+                n -= 1
+        elif op == 93:  # ']'
+            if n > 0:
+                n -= 1
+        elif op == 68:  # 'D'
+            if y < n:
+                for i in range(y, n - 1):
+                    buf[i] = buf[i + 1]
+                n -= 1
+        elif op == 39:  # "'"
+            if y < n:
+                n = y
+        elif op == 79:  # 'O'
+            if y < n:
+                m = min(z, n - y)
+                for i in range(y, n - m):
+                    buf[i] = buf[i + m]
+                n -= m
+        elif op == 120:  # 'x'
+            if y >= n:
+                n = 0
+            else:
+                m = min(z, n - y)
+                for i in range(m):
+                    buf[i] = buf[y + i]
+                n = m
+        elif op == 64:  # '@'
+            j = 0
+            for i in range(n):
+                if buf[i] != y:
+                    buf[j] = buf[i]
+                    j += 1
+            n = j
+
+        # Insertion rules
+        elif op == 36:  # '$'
+            if n + 1 > cap:
+                return -1
+            buf[n] = y
+            n += 1
+        elif op == 94:  # '^'
+            if n + 1 > cap:
+                return -1
+            for i in range(n, 0, -1):
+                buf[i] = buf[i - 1]
+            buf[0] = y
+            n += 1
+        elif op == 105:  # 'i'
+            if n + 1 > cap:
+                return -1
+            m = min(y, n)
+            for i in range(n, m, -1):
+                buf[i] = buf[i - 1]
+            buf[m] = z
+            n += 1
+
+        # Replacement rules
+        elif op == 111:  # 'o'
+            if y >= n:
+                return -1
+            buf[y] = z
+        elif op == 115:  # 's'
+            for i in range(n):
+                if buf[i] == y:
+                    buf[i] = z
+        elif op == 76:  # 'L'
+            if y >= n or buf[y] >= 0x40:
+                return -1
+            buf[y] <<= 1
+        elif op == 82:  # 'R'
+            if y >= n:
+                return -1
+            buf[y] >>= 1
+        elif op == 43:  # '+'
+            if y >= n or buf[y] >= 0x7F:
+                return -1
+            buf[y] += 1
+        elif op == 45:  # '-'
+            if y >= n or buf[y] == 0:
+                return -1
+            buf[y] -= 1
+        elif op == 46:  # '.'
+            if y + 1 >= n:
+                return -1
+            buf[y] = buf[y + 1]
+        elif op == 44:  # ','
+            if y == 0 or y >= n:
+                return -1
+            buf[y] = buf[y - 1]
+
+        # Swapping rules
+        elif op == 107:  # 'k'
+            if n < 2:
+                return -1
+            c = buf[0]
+            buf[0] = buf[1]
+            buf[1] = c
+        elif op == 75:  # 'K'
+            if n < 2:
+                return -1
+            c = buf[n - 2]
+            buf[n - 2] = buf[n - 1]
+            buf[n - 1] = c
+        elif op == 42:  # '*'
+            if y == z or y >= n or z >= n:
+                return -1
+            c = buf[y]
+            buf[y] = buf[z]
+            buf[z] = c
+
+        else:
+            return -1
+    return n
+
+
+@njit(cache=True)
+def _apply_rules_nb(src, length, opcodes, p0s, p1s, offsets, buf, out, out_lens) -> int:
+    """Run every rule on src, packing the results back to back into out"""
+    total = 0
+    for r in range(offsets.shape[0] - 1):
+        buf[:length] = src[:length]
+        start = offsets[r]
+        end = offsets[r + 1]
+        n = apply_rule_nb(buf, length, opcodes[start:end],
+                          p0s[start:end], p1s[start:end], end - start)
+        out_lens[r] = n
+        if n > 0:
+            out[total:total + n] = buf[:n]
+            total += n
+    return total
+
+
+_scratch = threading.local()
+
+def _get_scratch(n_rules: int):
+    """Per-thread scratch buffer and packed output, grown on demand"""
+    if getattr(_scratch, 'out_lens', None) is None or _scratch.out_lens.shape[0] < n_rules:
+        _scratch.buf = np.empty(MAX_LEN, dtype=np.uint8)
+        _scratch.out = np.empty(max(n_rules, 1) * MAX_LEN, dtype=np.uint8)
+        _scratch.out_lens = np.empty(max(n_rules, 1), dtype=np.int64)
+    return _scratch.buf, _scratch.out, _scratch.out_lens
+
+
+def apply_rules(password: str, encoded: EncodedRules) -> Set[str]:
+    """Apply encoded rules to a password, same results as hashcat_rule_gen.apply_rules"""
+    try:
+        src = np.frombuffer(password.encode('ascii'), dtype=np.uint8)
+    except UnicodeEncodeError:
+        src = None
+    if src is None or len(src) > MAX_LEN:
+        return hashcat_rule_gen.apply_rules(password, encoded.rules)
+
+    n_rules = len(encoded.rules)
+    buf, out, out_lens = _get_scratch(n_rules)
+    total = _apply_rules_nb(src, len(src), encoded.opcodes, encoded.p0s, encoded.p1s,
+                            encoded.offsets, buf, out, out_lens)
+
+    # Kernel output is always ASCII, so decode everything in one pass and slice
+    text = out[:total].tobytes().decode('ascii')
+    output = set()
+    start = 0
+    for r, length in enumerate(out_lens[:n_rules].tolist()):
+        if length >= 0:
+            output.add(text[start:start + length])
+            start += length
+            continue
+        try:
+            output.add(hashcat_rule_gen.apply_rule(password, encoded.rules[r]))
+        except Exception:
+            pass
+    return output
+
+
+# Batch engine: a whole wordlist is held as a (N, width) uint8 matrix plus a
+# lengths vector, and each rule op is applied to every row at once. A length
+# of -1 marks a row the kernel deferred; those are redone in Python.
+
+BATCH_WIDTH = 64
+
+
+@njit(parallel=True, cache=True)
+def _apply_op_rows(buf2d, lens, opcodes, p0s, p1s):
+    for i in prange(buf2d.shape[0]):
+        if lens[i] >= 0:
+            lens[i] = apply_rule_nb(buf2d[i], lens[i], opcodes, p0s, p1s, opcodes.shape[0])
+
+
+def _defer(lens: np.ndarray, mask: np.ndarray):
+    lens[mask & (lens >= 0)] = -1
+
+
+def apply_rule_batch(buf2d: np.ndarray, lens: np.ndarray, rule):
+    """Apply one encoded rule (opcodes, p0s, p1s) to every row of buf2d in-place"""
+    opcodes, p0s, p1s = rule
+    n_rows, width = buf2d.shape
+    rows = np.arange(n_rows)
+    for k in range(len(opcodes)):
+        op, y, z = chr(opcodes[k]), int(p0s[k]), int(p1s[k])
+        # Row-local rules, done as whole-matrix ops
+        if op == 'l':
+            buf2d[(buf2d >= 65) & (buf2d <= 90)] += 32
+        elif op == 'u':
+            buf2d[(buf2d >= 97) & (buf2d <= 122)] -= 32
+        elif op == 't':
+            buf2d[((buf2d >= 65) & (buf2d <= 90)) | ((buf2d >= 97) & (buf2d <= 122))] ^= 32
+        elif op == 'r':
+            idx = lens[:, None] - 1 - np.arange(width)
+            rev = np.take_along_axis(buf2d, np.clip(idx, 0, width - 1), axis=1)
+            np.copyto(buf2d, rev, where=idx >= 0)
+        elif op == '$':
+            _defer(lens, lens >= width)
+            ok = lens >= 0
+            buf2d[rows[ok], lens[ok]] = y
+            lens[ok] += 1
+        elif op == '^':
+            _defer(lens, lens >= width)
+            buf2d[:, 1:] = buf2d[:, :-1].copy()
+            buf2d[:, 0] = y
+            lens[lens >= 0] += 1
+        elif op in 'oTLR+-':
+            if y >= width:
+                _defer(lens, lens >= 0)
+                continue
+            col = buf2d[:, y]
+            bad = y >= lens
+            if op == 'L':
+                bad |= col >= 0x40
+            elif op == '+':
+                bad |= col >= 0x7F
+            elif op == '-':
+                bad |= col == 0
+            _defer(lens, bad)
+            ok = lens >= 0
+            if op == 'o':
+                col[ok] = z
+            elif op == 'T':
+                col[ok & (((col >= 65) & (col <= 90)) | ((col >= 97) & (col <= 122)))] ^= 32
+            elif op == 'L':
+                col[ok] <<= 1
+            elif op == 'R':
+                col[ok] >>= 1
+            elif op == '+':
+                col[ok] += 1
+            else:
+                col[ok] -= 1
+        else:
+            _apply_op_rows(buf2d, lens, opcodes[k:k + 1], p0s[k:k + 1], p1s[k:k + 1])
+
+
+def encode_batch(passwords: List[str], width: int):
+    """Pack ASCII passwords that fit into a (N, width) matrix, return it with the leftovers"""
+    fits = [p for p in passwords if len(p) <= width and p.isascii()]
+    rest = [p for p in passwords if not (len(p) <= width and p.isascii())]
+    buf2d = np.zeros((len(fits), width), dtype=np.uint8)
+    lens = np.fromiter((len(p) for p in fits), dtype=np.int64, count=len(fits))
+    flat = np.frombuffer(''.join(fits).encode('ascii'), dtype=np.uint8)
+    buf2d[np.arange(width) < lens[:, None]] = flat
+    return fits, buf2d, lens, rest
+
+
+def decode_unique(buf2d: np.ndarray, lens: np.ndarray) -> Set[str]:
+    """Decode the distinct successful rows of buf2d"""
+    ok = lens >= 0
+    rows, row_lens = np.ascontiguousarray(buf2d[ok]), lens[ok].tolist()
+    # Decode all rows in one pass and slice each to its length; the set does the
+    # deduplication. latin-1 never fails on the stale bytes past a row's length,
+    # and the bytes kept are ASCII.
+    width = rows.shape[1]
+    text = rows.tobytes().decode('latin-1')
+    return {text[i:i + n] for i, n in zip(range(0, len(text), width), row_lens)}
+
+
+def apply_rules_batch(passwords: List[str], rules: List[hashcat_rule_gen.Rule],
+                      width: int = BATCH_WIDTH) -> Set[str]:
+    """Apply every rule to every password, return the union of all results.
+    Same as merging hashcat_rule_gen.apply_rules over the passwords.
+    """
+    fits, base, base_lens, rest = encode_batch(list(passwords), width)
+    output = set()
+    for password in rest:
+        output |= hashcat_rule_gen.apply_rules(password, rules)
+
+    for rule in rules:
+        buf2d, lens = base.copy(), base_lens.copy()
+        apply_rule_batch(buf2d, lens, encode_rule(rule))
+        output |= decode_unique(buf2d, lens)
+        for i in np.flatnonzero(lens < 0):
+            try:
+                output.add(hashcat_rule_gen.apply_rule(fits[i], rule))
+            except Exception:
+                pass
+    return output
@@ -0,0 +1,218 @@
+"""Differential check of every rule engine against the hashcat_rule lambdas.
+
+Run with: python -m unittest test_rule_engines
+Engines whose optional dependencies are missing are skipped.
+"""
+import ast
+import multiprocessing
+import random
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import hashcat_rule_gen
+from hashcat_rule_gen import hashcat_rule, num_args_dict, parse_rule, expand_rule
+import parseOrderedRules
+from parseOrderedRules import export_rules, format_rule, parse_line
+
+try:
+    import rules_jit
+except ImportError:
+    rules_jit = None
+
+try:
+    import _rules
+except ImportError:
+    _rules = None
+
+try:
+    import rules_cuda
+    from numba import cuda
+    if not cuda.is_available():
+        rules_cuda = None
+except Exception:
+    rules_cuda = None
+
+POSITIONS = '0123456789ABCDEF'
+CHARS = 'aAzZ019 $@sSeE3!~é'
+POSITIONAL = set("TpZzYyD'xOoLR+-.,*i")
+
+
+def reference(password, rule):
+    """Apply a rule step by step with the lambdas, no engine or fast path"""
+    for rule_type, args in expand_rule(rule):
+        password = hashcat_rule[rule_type](password, *args)
+    return password
+
+
+def run(f, *args):
+    try:
+        return f(*args)
+    except Exception as e:
+        return type(e)
+
+
+def random_rule(rng):
+    ops = [op for op in num_args_dict if len(op) == 1]
+    parts = []
+    for _ in range(rng.randint(1, 5)):
+        op = rng.choice(ops)
+        step = op
+        for j in range(num_args_dict[op]):
+            if (j == 0 and op in POSITIONAL) or (j == 1 and op in 'xO*'):
+                step += rng.choice(POSITIONS[:8] if rng.random() < .8 else POSITIONS)
+            else:
+                step += rng.choice(CHARS)
+        parts.append(step)
+    rule = ' '.join(parts)
+    if rng.random() < .1:
+        rule = rule[:-1]  # Truncated rules leave the last step short of arguments
+    return rule
+
+
+def random_password(rng):
+    r = rng.random()
+    if r < .05:
+        return ''
+    if r < .08:
+        return 'é' + ''.join(rng.choice(CHARS) for _ in range(3))
+    return ''.join(rng.choice(CHARS + 'abcdefgh') for _ in range(rng.randint(1, 12)))
+
+
+class RuleEngineTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = random.Random(0)
+        cls.rules = []
+        for _ in range(600):
+            try:
+                cls.rules.append(parse_rule(random_rule(rng)))
+            except (KeyError, IndexError):
+                pass  # Not a rule the parser accepts
+        cls.rules += [parse_rule(r) for r in ('sa', '$', 'i3', 'o1', 'd d $1', 'd d d', '$1 $2 $3', '] ] ]')]
+        cls.passwords = [random_password(rng) for _ in range(150)] + ['banana', 'pass word', '']
+        cls.expected = {(p, i): run(reference, p, r) for p in cls.passwords for i, r in enumerate(cls.rules)}
+
+    def expected_set(self, password):
+        return {v for (p, _), v in self.expected.items() if p == password and isinstance(v, str)}
+
+    def assert_per_rule(self, apply):
+        for (password, i), expected in self.expected.items():
+            got = run(apply, password, self.rules[i])
+            self.assertEqual(got, expected, (password, self.rules[i]))
+
+    def test_apply_rule(self):
+        self.assert_per_rule(hashcat_rule_gen.apply_rule)
+
+    def test_compile_rule(self):
+        self.assert_per_rule(lambda p, r: hashcat_rule_gen.compile_rule(r)(p))
+
+    def test_fused_round_trip(self):
+        rng = random.Random(1)
+        for _ in range(300):
+            try:
+                rule = parse_rule(random_rule(rng))
+            except (KeyError, IndexError):
+                continue
+            expanded = expand_rule(rule)
+            self.assertEqual(hashcat_rule_gen.fuse_rule(expanded), rule)
+            self.assertEqual(expand_rule(hashcat_rule_gen.fuse_rule(expanded)), expanded)
+
+    def test_export_round_trip(self):
+        for line in ('d d $1 $2', 'd d d d d d d', '] ] [ [ [', '^a ^b $c $d', 'p3 d'):
+            self.assertEqual(format_rule(parse_rule(line)), line)
+
+    def test_parse_line(self):
+        lines = Path(__file__).with_name('best64_sorted_unparsed.rule').read_text().splitlines()
+        rng = random.Random(2)
+        for _ in range(300):
+            try:
+                rule = parse_rule(random_rule(rng))
+            except (KeyError, IndexError):
+                continue
+            lines += [repr(rule), repr(expand_rule(rule))]
+        # Shapes the regex must reject or accept exactly as Python does
+        lines += ["[('$', [01])]", "[('$', [\u0661])]", "[('$', [1]\v)]", "[('$', [1]\xa0)]",
+                  "[('$',\t[1]\r\n)]", "[('\n', [])]", "[('\\n', [])]", "[('$', [1,])]", "[]"]
+        for line in lines:
+            self.assertEqual(run(parse_line, line), run(ast.literal_eval, line), line)
+
+    def test_export_rules(self):
+        def write_text(rules, path, encoding="utf-8", newline="\n", mode="w"):
+            # Text-layer writer export_rules must match byte for byte
+            with open(path, mode=mode, encoding=encoding, newline="") as f:
+                for r in rules:
+                    f.write(r + newline)
+
+        long = [f'${i % 10}' for i in range(parseOrderedRules.EXPORT_CHUNK_SIZE * 2 + 5)]
+        cases = [([], {}), (['$1 $2', 'c', 'é ^ü'], {}), (['c', 'u'], {'mode': 'a'}),
+                 (['c', 'u'], {'mode': 'wt'}), (['c', 'u'], {'newline': '\r\n'}),
+                 (long, {}), (long, {'encoding': 'utf-16'}), (['c', 'é'], {'encoding': 'utf-8-sig', 'mode': 'a'})]
+        with tempfile.TemporaryDirectory() as tmp:
+            got, want = Path(tmp, 'out', 'rules.txt'), Path(tmp, 'want.txt')
+            for rules, kwargs in cases:
+                for existing in ([], ['r']):
+                    got.unlink(missing_ok=True)
+                    if existing:
+                        write_text(existing, got, kwargs.get('encoding', 'utf-8'))
+                    write_text(existing, want, kwargs.get('encoding', 'utf-8'))
+                    # A generator, so export_rules cannot rely on len() or indexing
+                    count = export_rules((r for r in rules), got, **kwargs)
+                    write_text(rules, want, **kwargs)
+                    self.assertEqual(count, len(rules))
+                    self.assertEqual(got.read_bytes(), want.read_bytes(), (existing, kwargs))
+
+    def assert_many(self, rules):
+        got = list(hashcat_rule_gen.apply_rules_many(self.passwords, rules, workers=2, chunksize=16))
+        self.assertEqual(got, [self.expected_set(p) for p in self.passwords])
+
+    def test_apply_rules_many(self):
+        self.assert_many(self.rules)
+
+    def test_apply_rules_many_compiled(self):
+        compiled = hashcat_rule_gen.compile_rules(self.rules)
+        if hashcat_rule_gen._pool_context().get_start_method() == 'fork':
+            self.assert_many(compiled)
+        else:
+            with self.assertRaises(TypeError):
+                next(hashcat_rule_gen.apply_rules_many(self.passwords, compiled))
+
+    @unittest.skipIf(rules_jit is None, "numba not installed")
+    def test_apply_rules_many_encoded(self):
+        self.assert_many(rules_jit.encode_rules(self.rules))
+
+    def test_apply_rules_many_spawn(self):
+        spawn = multiprocessing.get_context('spawn')
+        with mock.patch.object(hashcat_rule_gen, '_pool_context', return_value=spawn):
+            self.assert_many(self.rules)
+            with self.assertRaises(TypeError):
+                next(hashcat_rule_gen.apply_rules_many(self.passwords, hashcat_rule_gen.compile_rules(self.rules)))
+
+    @unittest.skipIf(_rules is None, "_rules extension not built")
+    def test_cython(self):
+        for (password, i), expected in self.expected.items():
+            got = run(_rules.apply_parsed_rule, password, self.rules[i])
+            if got is not None:
+                self.assertEqual(got, expected, (password, self.rules[i]))
+
+    @unittest.skipIf(rules_jit is None, "numba not installed")
+    def test_numba(self):
+        encoded = rules_jit.encode_rules(self.rules)
+        for password in self.passwords:
+            self.assertEqual(rules_jit.apply_rules(password, encoded), self.expected_set(password), password)
+
+    @unittest.skipIf(rules_jit is None, "numba not installed")
+    def test_numba_batch(self):
+        expected = set().union(*(self.expected_set(p) for p in self.passwords))
+        self.assertEqual(rules_jit.apply_rules_batch(self.passwords, self.rules), expected)
+
+    @unittest.skipIf(rules_cuda is None, "no CUDA device")
+    def test_cuda(self):
+        expected = set().union(*(self.expected_set(p) for p in self.passwords))
+        self.assertEqual(rules_cuda.apply_rules_cuda(self.passwords, self.rules, batch_size=64), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()